@@ -0,0 +1,87 @@
+import collections
+import hashlib
+import logging
+import os
+import stat
+import tempfile
+import threading
+
+
+logger = logging.getLogger(__name__)
+
+
+class ArtifactCache:
+    """Files built from source code (compiled programs, HTML previews) stored
+    under a hash of their language and source, evicting the least recently
+    used one past max_entries."""
+
+    def __init__(self, directory, max_entries=256, suffix='.out'):
+        self.max_entries = max_entries
+        self.suffix = suffix
+        self._lock = threading.Lock()
+        self._entries = collections.OrderedDict()
+
+        self.directory = self.private_directory(directory)
+
+        # Adopt what an earlier process left behind, oldest first. Other
+        # workers sharing the directory may be evicting the same files.
+        adopted = []
+        with os.scandir(self.directory) as it:
+            for entry in it:
+                if not entry.name.endswith(suffix):
+                    continue
+                try:
+                    adopted.append((entry.stat().st_mtime, entry.path))
+                except FileNotFoundError:
+                    continue
+        for _, path in sorted(adopted):
+            self._entries[path] = None
+        self._evict()
+
+    @staticmethod
+    def private_directory(directory):
+        """Returns directory, created if needed, as long as only this user can
+        write to it. A directory someone else owns or can write to could hold
+        planted files, so a fresh private one is used instead."""
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+        if not hasattr(os, 'getuid'):
+            return directory
+
+        st = os.lstat(directory)
+        if stat.S_ISDIR(st.st_mode) and st.st_uid == os.getuid() and not st.st_mode & 0o077:
+            return directory
+
+        logger.warning("%s is not private to this user, using a temporary directory instead", directory)
+        return tempfile.mkdtemp(prefix=f'{os.path.basename(directory)}-')
+
+    def path_for(self, language, code):
+        digest = hashlib.blake2b(f'{language}\0{code}'.encode(), digest_size=16).hexdigest()
+        return os.path.join(self.directory, f'{digest}{self.suffix}')
+
+    def lookup(self, path):
+        with self._lock:
+            if path not in self._entries:
+                return False
+            self._entries.move_to_end(path)
+        # Another worker process sharing the directory may have evicted it.
+        return os.path.exists(path)
+
+    def add(self, built_path, path):
+        """Atomically moves a freshly built file to its cache path."""
+        os.replace(built_path, path)
+        with self._lock:
+            self._entries[path] = None
+            self._entries.move_to_end(path)
+        self._evict()
+
+    def _evict(self):
+        with self._lock:
+            evicted = []
+            while len(self._entries) > self.max_entries:
+                evicted.append(self._entries.popitem(last=False)[0])
+
+        for old_path in evicted:
+            try:
+                os.remove(old_path)
+            except FileNotFoundError:
+                pass
@@ -0,0 +1,88 @@
+import ast
+import operator
+
+
+# Snippets longer than this always go to the kernel.
+TRIVIAL_CODE_LIMIT = 1024
+
+BINARY_OPERATORS = {
+    ast.Add: operator.add,
+    ast.Sub: operator.sub,
+    ast.Mult: operator.mul,
+    ast.Div: operator.truediv,
+    ast.FloorDiv: operator.floordiv,
+    ast.Mod: operator.mod,
+}
+
+UNARY_OPERATORS = {
+    ast.UAdd: operator.pos,
+    ast.USub: operator.neg,
+}
+
+NUMBER_TYPES = (int, float)
+
+
+class NotTrivial(Exception):
+    pass
+
+
+def evaluate_literal(node):
+    # Only literals and arithmetic on numbers: no names, so the result cannot
+    # depend on or change the session, and no ** or string repetition, so it
+    # cannot blow up.
+    if isinstance(node, ast.Constant) and type(node.value) in (int, float, str):
+        return node.value
+
+    if isinstance(node, ast.UnaryOp) and type(node.op) in UNARY_OPERATORS:
+        operand = evaluate_literal(node.operand)
+        if type(operand) in NUMBER_TYPES:
+            return UNARY_OPERATORS[type(node.op)](operand)
+
+    if isinstance(node, ast.BinOp) and type(node.op) in BINARY_OPERATORS:
+        left = evaluate_literal(node.left)
+        right = evaluate_literal(node.right)
+        if type(left) in NUMBER_TYPES and type(right) in NUMBER_TYPES:
+            return BINARY_OPERATORS[type(node.op)](left, right)
+
+    raise NotTrivial
+
+
+def run_trivial_python(code):
+    """Returns what the Python kernel would output for code made only of
+    print() calls and arithmetic on literals, or None if the kernel is needed.
+
+    The kernel never sees such code, so it does not bump the session's
+    execution count or set _, and a session that rebound print (say
+    print = len) still gets the builtin print's output here."""
+    # A trailing semicolon makes IPython hide the last value.
+    if len(code) > TRIVIAL_CODE_LIMIT or code.rstrip().endswith(';'):
+        return None
+
+    try:
+        statements = ast.parse(code).body
+        if not statements:
+            return None
+
+        printed = []
+        result = None
+        for statement in statements:
+            if not isinstance(statement, ast.Expr):
+                return None
+
+            value = statement.value
+            if (isinstance(value, ast.Call) and isinstance(value.func, ast.Name)
+                    and value.func.id == 'print' and not value.keywords):
+                printed.append(' '.join(str(evaluate_literal(arg)) for arg in value.args) + '\n')
+                result = None
+            else:
+                result = repr(evaluate_literal(value))
+
+    except (NotTrivial, SyntaxError, ArithmeticError, RecursionError, ValueError):
+        return None
+
+    chunks = []
+    if printed:
+        chunks.append(''.join(printed))
+    if result is not None:
+        chunks.append(result)
+    return '\n'.join(chunks)
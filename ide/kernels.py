@@ -0,0 +1,249 @@
+import collections
+import contextlib
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import jupyter_client
+import zmq
+from django.conf import settings
+
+
+logger = logging.getLogger(__name__)
+
+# Seconds a started kernel gets to answer before it is given up on.
+KERNEL_READY_TIMEOUT = 60
+
+
+def time_left(deadline):
+    return max(deadline - time.monotonic(), 0)
+
+
+def iopub_messages(kc, deadline):
+    """Yields the kernel's IOPub messages, raising queue.Empty once nothing
+    arrives before the deadline. Each poll is followed by non-blocking reads of
+    everything already queued on the socket, rather than one poll per
+    message as kc.get_iopub_msg does."""
+    socket = kc.iopub_channel.socket
+    session = kc.session
+    while True:
+        if not socket.poll(int(time_left(deadline) * 1000)):
+            raise queue.Empty
+        while True:
+            try:
+                parts = socket.recv_multipart(zmq.NOBLOCK)
+            except zmq.Again:
+                break
+            _, parts = session.feed_identities(parts)
+            yield session.deserialize(parts)
+
+
+def drain_pending(kc):
+    """Discards replies and output left queued by an earlier execution that
+    timed out or stopped reading at its first error."""
+    for channel in (kc.shell_channel, kc.iopub_channel):
+        while True:
+            try:
+                channel.socket.recv_multipart(zmq.NOBLOCK)
+            except zmq.Again:
+                break
+
+
+def wait_for_abort_to_end(kc, deadline):
+    """ipykernel sends the error reply of an execution before it starts
+    aborting the requests queued behind it, so one sent right after the reply
+    can still be aborted. Round-trips empty silent executions until one is not
+    aborted, raising queue.Empty if the deadline passes first."""
+    while True:
+        msg_id = kc.execute('', silent=True, store_history=False, stop_on_error=False)
+        reply = kc.get_shell_msg(timeout=time_left(deadline))
+        while reply['parent_header'].get('msg_id') != msg_id:
+            reply = kc.get_shell_msg(timeout=time_left(deadline))
+        if reply['content']['status'] != 'aborted':
+            return
+
+
+def interrupt_execution(km, kc, msg_ids, timeout):
+    """Interrupts the kernel and waits for the execute_reply of each of
+    msg_ids, so the next execution is not queued behind the interrupted one
+    and aborted with it. Restarts the kernel if it has not settled within
+    timeout seconds."""
+    km.interrupt_kernel()
+    unreplied = set(msg_ids)
+    deadline = time.monotonic() + timeout
+    try:
+        while unreplied:
+            reply = kc.get_shell_msg(timeout=time_left(deadline))
+            unreplied.discard(reply['parent_header'].get('msg_id'))
+        wait_for_abort_to_end(kc, deadline)
+    except queue.Empty:
+        logger.warning("Kernel %s did not answer the interrupt, restarting it", km.kernel_name)
+        km.restart_kernel(now=True)
+        kc.wait_for_ready(timeout=KERNEL_READY_TIMEOUT)
+
+
+class KernelPool:
+    """Keeps a few idle, already started kernels per kernel name so that a
+    new session does not pay for the kernel process start-up and channel
+    handshake on its first request."""
+
+    def __init__(self, sizes):
+        self.sizes = sizes
+        self._idle = {kernel_name: queue.Queue() for kernel_name in sizes}
+        self._refill_lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='kernel-pool')
+
+    def start_kernel(self, kernel_name):
+        km = jupyter_client.KernelManager(kernel_name=kernel_name)
+        km.start_kernel()
+        kc = km.client()
+        kc.start_channels()
+        # Otherwise the first execution's output can be published before the
+        # IOPub subscription is set up, and lost.
+        try:
+            kc.wait_for_ready(timeout=KERNEL_READY_TIMEOUT)
+        except RuntimeError:
+            kc.stop_channels()
+            km.shutdown_kernel(now=True)
+            raise
+        return km, kc
+
+    def warm_up(self):
+        threading.Thread(target=self._warm_up, name='kernel-pool-warm-up', daemon=True).start()
+
+    def _warm_up(self):
+        installed = jupyter_client.kernelspec.find_kernel_specs()
+        for kernel_name in self._idle:
+            if kernel_name not in installed:
+                logger.warning("Kernel %s is not installed, not pre-warming it", kernel_name)
+                continue
+            self.refill(kernel_name)
+
+    def refill(self, kernel_name):
+        idle = self._idle[kernel_name]
+        with self._refill_lock:
+            while idle.qsize() < self.sizes[kernel_name]:
+                try:
+                    idle.put(self.start_kernel(kernel_name))
+                except Exception as e:
+                    logger.exception("Could not pre-warm kernel %s: %s", kernel_name, e)
+                    return
+                logger.debug("Pre-warmed kernel %s, %d idle", kernel_name, idle.qsize())
+
+    def acquire(self, kernel_name):
+        if kernel_name not in self._idle:
+            return self.start_kernel(kernel_name)
+
+        while True:
+            try:
+                km, kc = self._idle[kernel_name].get_nowait()
+            except queue.Empty:
+                logger.debug("No idle kernel for %s, starting one", kernel_name)
+                km, kc = self.start_kernel(kernel_name)
+                break
+            if km.is_alive():
+                break
+            kc.stop_channels()
+            km.shutdown_kernel(now=True)
+
+        self._executor.submit(self.refill, kernel_name)
+        return km, kc
+
+
+class SessionRegistry:
+    """Live kernel of each session, keyed by (user id, language). Sessions
+    idle for longer than idle_timeout seconds, or the least recently used ones
+    past max_sessions, have their kernel shut down."""
+
+    def __init__(self, pool, max_executions_per_language, max_sessions, idle_timeout):
+        self.pool = pool
+        self.max_executions_per_language = max_executions_per_language
+        self.max_sessions = max_sessions
+        self.idle_timeout = idle_timeout
+        self._lock = threading.RLock()
+        self._kernels = {}
+        self._last_used = collections.OrderedDict()
+        self._kernel_locks = collections.defaultdict(threading.Lock)
+        self._language_slots = {}
+
+    @contextlib.contextmanager
+    def executing(self, key, kernel_name):
+        """Yields the session's (km, kc) for one execution, waiting while
+        another request uses it or the language has too many executions
+        running."""
+        _, language = key
+        self.reap()
+
+        while True:
+            with self._lock:
+                kernel_lock = self._kernel_locks[key]
+                slots = self._language_slots.get(language)
+                if slots is None:
+                    slots = self._language_slots[language] = threading.BoundedSemaphore(self.max_executions_per_language)
+
+            # Take the kernel first so waiting on it does not hold a language slot.
+            with kernel_lock:
+                with self._lock:
+                    if self._kernel_locks.get(key) is not kernel_lock:
+                        # Reaped while we waited; start over with a fresh session.
+                        continue
+                kernel = self._get_or_create_kernel(key, kernel_name)
+                with slots:
+                    yield kernel
+                return
+
+    def _get_or_create_kernel(self, key, kernel_name):
+        # Only called under the session's kernel lock, so there is no race to
+        # create the same session twice.
+        with self._lock:
+            kernel = self._kernels.get(key)
+            if kernel is not None:
+                self._last_used[key] = time.monotonic()
+                self._last_used.move_to_end(key)
+                return kernel
+
+        self.reap(reserve=1)
+        kernel = self.pool.acquire(kernel_name)
+        with self._lock:
+            self._kernels[key] = kernel
+            self._last_used[key] = time.monotonic()
+        return kernel
+
+    def reap(self, reserve=0):
+        """Shuts down the kernels of idle sessions, and of the least recently
+        used ones while more than max_sessions - reserve are alive. Sessions in
+        the middle of an execution are left alone."""
+        now = time.monotonic()
+        reaped = []
+        with self._lock:
+            for key, last_used in list(self._last_used.items()):
+                over_capacity = len(self._kernels) + reserve > self.max_sessions
+                if not over_capacity and now - last_used < self.idle_timeout:
+                    break
+
+                kernel_lock = self._kernel_locks.get(key)
+                if kernel_lock is not None and not kernel_lock.acquire(blocking=False):
+                    continue
+                try:
+                    del self._last_used[key]
+                    self._kernel_locks.pop(key, None)
+                    reaped.append(self._kernels.pop(key))
+                finally:
+                    if kernel_lock is not None:
+                        kernel_lock.release()
+
+        for km, kc in reaped:
+            logger.debug("Shutting down idle session kernel %s", km.kernel_name)
+            kc.stop_channels()
+            km.shutdown_kernel(now=True)
+
+
+kernel_pool = KernelPool(getattr(settings, 'IDE_KERNEL_POOL_SIZES', {}))
+sessions = SessionRegistry(
+    kernel_pool,
+    getattr(settings, 'IDE_MAX_EXECUTIONS_PER_LANGUAGE', 4),
+    getattr(settings, 'IDE_MAX_SESSIONS', 32),
+    getattr(settings, 'IDE_SESSION_IDLE_TIMEOUT', 30 * 60),
+)
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-15 21:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ide', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='codeexecutionsession',
+            name='variables',
+            field=models.JSONField(default=dict),
+        ),
+    ]
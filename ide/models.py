@@ -1,17 +1,41 @@
 from django.db import models
 from django.contrib.auth.models import User
+import hashlib
 import json
 
+
+def variables_fingerprint(variables):
+    return hashlib.blake2b(json.dumps(variables, sort_keys=True).encode(), digest_size=8).digest()
+
+
 class CodeExecutionSession(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE, null=True)
     session_id = models.CharField(max_length=255)
-    variables = models.TextField(default="{}")  
+    variables = models.JSONField(default=dict)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    # Fingerprint of the variables as last loaded or saved, None if unknown.
+    _variables_fingerprint = None
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        if 'variables' in field_names:
+            instance._variables_fingerprint = variables_fingerprint(instance.variables)
+        return instance
+
     def get_variables(self):
-        return json.loads(self.variables)
+        return self.variables
 
     def set_variables(self, variables_dict):
-        self.variables = json.dumps(variables_dict)
-        self.save()
+        fingerprint = variables_fingerprint(variables_dict)
+        if fingerprint == self._variables_fingerprint:
+            return
+
+        self.variables = variables_dict
+        if self._state.adding:
+            self.save()
+        else:
+            self.save(update_fields=['variables', 'updated_at'])
+        self._variables_fingerprint = fingerprint
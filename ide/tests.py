@@ -1,3 +1,498 @@
-from django.test import TestCase
+import os
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
 
-# Create your tests here.
+import jupyter_client
+
+from django.test import SimpleTestCase, TestCase
+from rest_framework.test import APIRequestFactory
+
+from .compilers import ArtifactCache
+from .fastpath import TRIVIAL_CODE_LIMIT, run_trivial_python
+from .kernels import KernelPool, SessionRegistry
+from .models import CodeExecutionSession
+from .views import (
+    JAVAC_JVM_OPTIONS, ExecuteAllCodeView, ExecuteCodeView, OutputBuffer, TIMEOUT_ERROR, java_class_name,
+)
+
+
+class ArtifactCacheTests(SimpleTestCase):
+    def setUp(self):
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        self.directory = os.path.join(tmp_dir.name, 'cache')
+
+    def build(self, cache, language, code):
+        path = cache.path_for(language, code)
+        fd, built_path = tempfile.mkstemp(suffix='.tmp', dir=cache.directory)
+        os.close(fd)
+        cache.add(built_path, path)
+        return path
+
+    def test_path_depends_on_language_and_source(self):
+        cache = ArtifactCache(self.directory)
+        self.assertEqual(cache.path_for('c', 'int main;'), cache.path_for('c', 'int main;'))
+        self.assertNotEqual(cache.path_for('c', 'int main;'), cache.path_for('cpp', 'int main;'))
+        self.assertNotEqual(cache.path_for('c', 'int main;'), cache.path_for('c', 'int main; '))
+
+    def test_lookup_after_add(self):
+        cache = ArtifactCache(self.directory)
+        path = cache.path_for('c', 'a')
+        self.assertFalse(cache.lookup(path))
+
+        self.build(cache, 'c', 'a')
+        self.assertTrue(cache.lookup(path))
+        self.assertTrue(os.path.exists(path))
+
+    def test_lookup_misses_when_file_was_removed(self):
+        cache = ArtifactCache(self.directory)
+        path = self.build(cache, 'c', 'a')
+        os.remove(path)
+        self.assertFalse(cache.lookup(path))
+
+    def test_evicts_least_recently_used(self):
+        cache = ArtifactCache(self.directory, max_entries=2)
+        a = self.build(cache, 'c', 'a')
+        b = self.build(cache, 'c', 'b')
+        cache.lookup(a)
+        c = self.build(cache, 'c', 'c')
+
+        self.assertTrue(cache.lookup(a))
+        self.assertFalse(cache.lookup(b))
+        self.assertFalse(os.path.exists(b))
+        self.assertTrue(cache.lookup(c))
+
+    def test_adopts_existing_files_oldest_first(self):
+        os.makedirs(self.directory, mode=0o700)
+        paths = []
+        for i, name in enumerate(['old.out', 'middle.out', 'new.out']):
+            path = os.path.join(self.directory, name)
+            open(path, 'w').close()
+            os.utime(path, (time.time() - 100 + i, time.time() - 100 + i))
+            paths.append(path)
+        open(os.path.join(self.directory, 'partial.tmp'), 'w').close()
+
+        cache = ArtifactCache(self.directory, max_entries=2)
+
+        self.assertFalse(os.path.exists(paths[0]))
+        self.assertTrue(cache.lookup(paths[1]))
+        self.assertTrue(cache.lookup(paths[2]))
+        self.assertFalse(cache.lookup(os.path.join(self.directory, 'partial.tmp')))
+
+    def test_does_not_use_a_directory_others_can_write_to(self):
+        os.makedirs(self.directory)
+        os.chmod(self.directory, 0o777)
+
+        cache = ArtifactCache(self.directory)
+        self.addCleanup(os.rmdir, cache.directory)
+
+        self.assertNotEqual(cache.directory, self.directory)
+        self.assertEqual(os.stat(cache.directory).st_mode & 0o777, 0o700)
+
+
+@mock.patch('ide.views.subprocess.Popen')
+@mock.patch('ide.views.os.name', 'posix')
+class HtmlPreviewTests(SimpleTestCase):
+    def setUp(self):
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        self.cache = ArtifactCache(os.path.join(tmp_dir.name, 'previews'), suffix='.html')
+        patcher = mock.patch('ide.views.preview_cache', self.cache)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def preview_path(self, code):
+        output, error = ExecuteCodeView().execute_html_css(code)
+        self.assertIsNone(error)
+        return output.split('file://', 1)[1]
+
+    def test_identical_sources_share_one_file(self, popen):
+        path = self.preview_path('<p>same</p>')
+        self.assertEqual(self.preview_path('<p>same</p>'), path)
+        self.assertNotEqual(self.preview_path('<p>other</p>'), path)
+        with open(path) as preview:
+            self.assertEqual(preview.read(), '<p>same</p>')
+        popen.assert_any_call([mock.ANY, path])
+
+    def test_previews_live_in_a_private_directory(self, popen):
+        path = self.preview_path('<p>private</p>')
+        self.assertEqual(os.path.dirname(path), self.cache.directory)
+        self.assertEqual(os.stat(self.cache.directory).st_mode & 0o077, 0)
+
+
+@mock.patch('ide.views.resolve_executable', lambda name: f'/usr/bin/{name}')
+class ExecutionCommandTests(SimpleTestCase):
+    def command(self, language, file_path):
+        return ExecuteCodeView().get_execution_command(language, file_path)
+
+    def test_c_is_compiled_from_stdin(self):
+        self.assertEqual(self.command('c', '/tmp/prog.tmp'), (
+            ['/usr/bin/gcc', '-pipe', '-x', 'c', '-o', '/tmp/prog.tmp', '-'],
+            ['/tmp/prog.tmp'],
+        ))
+
+    def test_cpp_is_compiled_from_stdin(self):
+        self.assertEqual(self.command('cpp', '/tmp/prog.tmp'), (
+            ['/usr/bin/g++', '-pipe', '-x', 'c++', '-o', '/tmp/prog.tmp', '-'],
+            ['/tmp/prog.tmp'],
+        ))
+
+    def test_java_runs_the_class_from_its_directory(self):
+        self.assertEqual(self.command('java', '/tmp/run/Foo.java'), (
+            ['/usr/bin/javac', *JAVAC_JVM_OPTIONS, '/tmp/run/Foo.java'],
+            ['/usr/bin/java', '-cp', '/tmp/run', 'Foo'],
+        ))
+
+    def test_unsupported_language(self):
+        self.assertIsNone(self.command('python', '/tmp/prog.py'))
+
+
+
+class JavaClassNameTests(SimpleTestCase):
+    def test_public_class(self):
+        self.assertEqual(java_class_name('class Helper {}\npublic class Foo {}'), 'Foo')
+
+    def test_modifiers_in_any_order(self):
+        for code in (
+            'final public class Foo {}',
+            'public final abstract class Foo {}',
+            'public strictfp class Foo {}',
+            'public sealed class Foo permits Bar {}',
+            'non-sealed public class Foo extends Bar {}',
+        ):
+            with self.subTest(code=code):
+                self.assertEqual(java_class_name(code), 'Foo')
+
+    def test_first_class_without_a_public_one(self):
+        self.assertEqual(java_class_name('final class Foo {}\nclass Bar {}'), 'Foo')
+
+    def test_defaults_to_main(self):
+        self.assertEqual(java_class_name('interface Foo {}'), 'Main')
+
+    def test_comments_and_strings_are_ignored(self):
+        code = (
+            '/**\n public class Doc */\n'
+            '// public class Line\n'
+            'public class Foo {\n'
+            '    String s = "}\\" public class Str {";\n'
+            '    char c = \'}\';\n'
+            '}\n'
+        )
+        self.assertEqual(java_class_name(code), 'Foo')
+        self.assertEqual(java_class_name('String s = """\n{\n""";\nclass Foo {}'), 'Foo')
+
+    def test_nested_classes_are_ignored(self):
+        code = 'class Main {\n    public static class Inner {}\n}\n'
+        self.assertEqual(java_class_name(code), 'Main')
+
+
+
+class RequestValidationTests(SimpleTestCase):
+    def post(self, view, data):
+        request = APIRequestFactory().post('/', data, format='json')
+        # Debug logging must not trip over unvalidated input.
+        with self.assertLogs('ide.views', 'DEBUG'):
+            return view.as_view()(request)
+
+    def test_missing_code(self):
+        for data in ({'language': 'c'}, {'code': None, 'language': 'c'}, {'code': 'x', 'language': None}):
+            with self.subTest(data=data):
+                self.assertEqual(self.post(ExecuteCodeView, data).status_code, 400)
+
+    def test_missing_code_blocks(self):
+        for data in ({'language': 'c'}, {'code_blocks': None, 'language': 'c'}, {'code_blocks': [], 'language': 'c'}):
+            with self.subTest(data=data):
+                self.assertEqual(self.post(ExecuteAllCodeView, data).status_code, 400)
+
+
+class OutputBufferTests(SimpleTestCase):
+    def test_joins_chunks_with_newlines(self):
+        buffer = OutputBuffer(limit=100)
+        buffer.append('a\n')
+        buffer.append('3')
+        self.assertEqual(buffer.getvalue(), 'a\n\n3')
+        self.assertFalse(buffer.truncated)
+
+    def test_output_exactly_at_the_limit_is_kept_whole(self):
+        buffer = OutputBuffer(limit=6)
+        buffer.append('abc')
+        buffer.append('def')
+        self.assertFalse(buffer.truncated)
+        self.assertEqual(buffer.getvalue(), 'abc\ndef')
+
+    def test_truncates_past_the_limit(self):
+        buffer = OutputBuffer(limit=5)
+        buffer.append('abc')
+        buffer.append('defgh')
+        buffer.append('ignored')
+        self.assertTrue(buffer.truncated)
+        self.assertEqual(buffer.size, 5)
+        self.assertEqual(buffer.getvalue(), 'abc\nde\n...[output truncated]')
+
+    def test_chunk_after_a_full_buffer_only_marks_it_truncated(self):
+        buffer = OutputBuffer(limit=6)
+        buffer.append('abc\n')
+        buffer.append('de')
+        buffer.append('f')
+        self.assertTrue(buffer.truncated)
+        self.assertEqual(buffer.getvalue(), 'abc\n\nde\n...[output truncated]')
+
+    def test_single_oversized_chunk_is_cut(self):
+        buffer = OutputBuffer(limit=4)
+        buffer.append('x' * 1000)
+        self.assertEqual(buffer.getvalue(), 'xxxx\n...[output truncated]')
+
+
+class CodeExecutionSessionTests(TestCase):
+    def setUp(self):
+        CodeExecutionSession(session_id='s').set_variables({'a': 1, 'b': [1, 2]})
+        self.session = CodeExecutionSession.objects.get()
+
+    def test_unchanged_variables_are_not_saved(self):
+        with self.assertNumQueries(0):
+            self.session.set_variables({'b': [1, 2], 'a': 1})
+
+    def test_changed_variables_are_saved(self):
+        with self.assertNumQueries(1):
+            self.session.set_variables({'a': 2})
+        self.assertEqual(CodeExecutionSession.objects.get().get_variables(), {'a': 2})
+
+    def test_in_place_changes_are_saved(self):
+        variables = self.session.get_variables()
+        variables['c'] = 3
+        self.session.set_variables(variables)
+        self.assertEqual(CodeExecutionSession.objects.get().get_variables(), {'a': 1, 'b': [1, 2], 'c': 3})
+
+    def test_setting_the_saved_value_again_is_a_no_op(self):
+        self.session.set_variables({'a': 2})
+        with self.assertNumQueries(0):
+            self.session.set_variables({'a': 2})
+
+
+class TrivialPythonTests(SimpleTestCase):
+    def test_prints_and_arithmetic(self):
+        self.assertEqual(run_trivial_python('print("hi", 1 + 2)'), 'hi 3\n')
+        self.assertEqual(run_trivial_python('7 // 2 - -1.5 % 2'), '2.5')
+
+    def test_print_followed_by_an_expression(self):
+        self.assertEqual(run_trivial_python('print(2); 3'), '2\n\n3')
+        self.assertEqual(run_trivial_python('3\nprint(2)'), '2\n')
+
+    def test_trailing_semicolon_needs_the_kernel(self):
+        self.assertIsNone(run_trivial_python('1 + 1;'))
+        self.assertIsNone(run_trivial_python('print(1);  \n'))
+
+    def test_arithmetic_errors_need_the_kernel(self):
+        for code in ('1 / 0', '1 // 0', '1 % 0', '1e308 * 10 // 0', 'print(1 / 0)'):
+            with self.subTest(code=code):
+                self.assertIsNone(run_trivial_python(code))
+
+    def test_power_and_string_repetition_need_the_kernel(self):
+        self.assertIsNone(run_trivial_python('2 ** 10'))
+        self.assertIsNone(run_trivial_python('"a" * 10'))
+
+    def test_names_need_the_kernel(self):
+        for code in ('x = 1', 'x', 'print(x)', 'x + 1', 'print(1, sep="")', 'len("a")'):
+            with self.subTest(code=code):
+                self.assertIsNone(run_trivial_python(code))
+
+    def test_size_limit(self):
+        code = '1 + 1' + ' ' * (TRIVIAL_CODE_LIMIT - 5)
+        self.assertEqual(run_trivial_python(code), '2')
+        self.assertIsNone(run_trivial_python(code + ' '))
+
+    def test_empty_code_needs_the_kernel(self):
+        self.assertIsNone(run_trivial_python(''))
+        self.assertIsNone(run_trivial_python('# comment'))
+
+
+
+
+class KernelPoolTests(SimpleTestCase):
+    def setUp(self):
+        self.pool = KernelPool({'python3': 1})
+        self.addCleanup(self.pool._executor.shutdown)
+        patcher = mock.patch.object(self.pool, 'start_kernel', side_effect=lambda name: (mock.Mock(), mock.Mock()))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_dead_idle_kernels_are_shut_down(self):
+        dead_km, dead_kc = mock.Mock(), mock.Mock()
+        dead_km.is_alive.return_value = False
+        self.pool._idle['python3'].put((dead_km, dead_kc))
+
+        km, kc = self.pool.acquire('python3')
+
+        self.assertIsNot(km, dead_km)
+        dead_kc.stop_channels.assert_called_once_with()
+        dead_km.shutdown_kernel.assert_called_once_with(now=True)
+
+
+
+class FakeKernelPool:
+    def __init__(self):
+        self.started = []
+
+    def acquire(self, kernel_name):
+        kernel = (mock.Mock(), mock.Mock())
+        self.started.append(kernel)
+        return kernel
+
+
+class GatedLock:
+    """Lock that lets the test run something between a thread asking for
+    it and getting it."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.waiting = threading.Event()
+        self.gate = threading.Event()
+
+    def acquire(self, blocking=True):
+        return self.lock.acquire(blocking)
+
+    def release(self):
+        self.lock.release()
+
+    def __enter__(self):
+        self.waiting.set()
+        self.gate.wait()
+        self.lock.acquire()
+
+    def __exit__(self, *exc_info):
+        self.lock.release()
+
+
+class SessionRegistryTests(SimpleTestCase):
+    def setUp(self):
+        self.pool = FakeKernelPool()
+
+    def registry(self, max_sessions=4, idle_timeout=60):
+        return SessionRegistry(self.pool, 2, max_sessions, idle_timeout)
+
+    def use(self, registry, owner):
+        with registry.executing((owner, 'python'), 'python3') as kernel:
+            return kernel
+
+    def assertShutDown(self, kernel):
+        km, kc = kernel
+        kc.stop_channels.assert_called_once_with()
+        km.shutdown_kernel.assert_called_once_with(now=True)
+
+    def test_session_keeps_its_kernel(self):
+        registry = self.registry()
+        self.assertIs(self.use(registry, 'a'), self.use(registry, 'a'))
+        self.assertIsNot(self.use(registry, 'a'), self.use(registry, 'b'))
+        self.assertEqual(len(self.pool.started), 2)
+
+    def test_idle_sessions_are_reaped(self):
+        registry = self.registry(idle_timeout=0)
+        first = self.use(registry, 'a')
+        self.use(registry, 'b')
+        self.assertShutDown(first)
+        self.assertIsNot(self.use(registry, 'a'), first)
+
+    def test_least_recently_used_session_is_reaped_past_max_sessions(self):
+        registry = self.registry(max_sessions=2)
+        a = self.use(registry, 'a')
+        b = self.use(registry, 'b')
+        self.use(registry, 'a')
+        # Room is made before the new kernel is acquired.
+        self.use(registry, 'c')
+        self.assertShutDown(b)
+        a[0].shutdown_kernel.assert_not_called()
+        self.assertIs(self.use(registry, 'a'), a)
+
+    def test_busy_sessions_are_not_reaped(self):
+        registry = self.registry(max_sessions=1)
+        with registry.executing(('a', 'python'), 'python3') as a:
+            self.use(registry, 'b')
+            a[0].shutdown_kernel.assert_not_called()
+        registry.reap()
+        self.assertShutDown(a)
+
+    def test_waiter_starts_over_when_its_session_is_reaped(self):
+        registry = self.registry()
+        first = self.use(registry, 'a')
+        lock = registry._kernel_locks[('a', 'python')] = GatedLock()
+        kernels = []
+
+        def wait():
+            with registry.executing(('a', 'python'), 'python3') as kernel:
+                current_lock = registry._kernel_locks.get(('a', 'python'))
+                kernels.append((kernel, current_lock is not None and current_lock.locked()))
+
+        waiter = threading.Thread(target=wait)
+        waiter.start()
+        self.addCleanup(waiter.join)
+
+        # Reap the session while the waiter holds on to its old lock.
+        self.assertTrue(lock.waiting.wait(5))
+        registry.idle_timeout = 0
+        registry.reap()
+        registry.idle_timeout = 60
+        lock.gate.set()
+        waiter.join(5)
+
+        self.assertShutDown(first)
+        kernel, holds_current_lock = kernels[0]
+        self.assertIsNot(kernel, first)
+        self.assertTrue(holds_current_lock)
+        self.assertIs(self.use(registry, 'a'), kernel)
+
+
+@unittest.skipUnless('python3' in jupyter_client.kernelspec.find_kernel_specs(), "needs the python3 kernel")
+class KernelExecutionTests(SimpleTestCase):
+    def setUp(self):
+        registry = SessionRegistry(KernelPool({}), 1, 1, 60)
+        patcher = mock.patch('ide.views.sessions', registry)
+        patcher.start()
+        self.addCleanup(self.shut_down, registry)
+        self.addCleanup(patcher.stop)
+        # The kernel's first execution is slow, keep it out of the timeouts.
+        self.assertEqual(self.execute('x = 1'), ("executed succesfully.", None))
+
+    def shut_down(self, registry):
+        registry.idle_timeout = 0
+        registry.reap()
+
+    def execute(self, code):
+        return ExecuteCodeView().execute_code_with_jupyter('python', code, 'block', 'user')
+
+    def execute_all(self, blocks):
+        return ExecuteAllCodeView().execute_blocks_with_jupyter('python', blocks, 'user')
+
+    @mock.patch('ide.views.EXECUTION_TIMEOUT', 1)
+    def test_session_is_usable_after_a_timeout(self):
+        self.assertEqual(self.execute('while True: pass'), (None, TIMEOUT_ERROR))
+        # Neither is queued behind the interrupted execution and aborted with it.
+        self.assertEqual(self.execute('import os; print(os.getpid() > 0)'), ('True\n', None))
+        self.assertEqual(self.execute('print(x)'), ('1\n', None))
+
+    @mock.patch('ide.views.EXECUTION_TIMEOUT', 1)
+    def test_session_is_usable_after_a_pipelined_timeout(self):
+        results = self.execute_all([('a', 'x = 2'), ('b', 'while True: pass'), ('c', 'print(x)')])
+        self.assertEqual(results, [
+            ('a', "executed succesfully.", None),
+            ('b', None, TIMEOUT_ERROR),
+            ('c', None, TIMEOUT_ERROR),
+        ])
+        self.assertEqual(self.execute('print(x)'), ('2\n', None))
+
+    @mock.patch('ide.views.EXECUTION_TIMEOUT', 1)
+    @mock.patch('ide.views.INTERRUPT_TIMEOUT', 1)
+    def test_kernel_is_restarted_when_the_interrupt_is_not_answered(self):
+        # One long C call, which only sees the interrupt once it returns.
+        self.assertEqual(self.execute('sum(range(10**10))'), (None, TIMEOUT_ERROR))
+        self.assertEqual(self.execute('print("x" in dir())'), ('False\n', None))
+
+    def test_errors_do_not_abort_the_next_execution(self):
+        self.assertEqual(self.execute('1 / 0'), (None, 'division by zero'))
+        self.assertEqual(self.execute('print(x)'), ('1\n', None))
+        results = self.execute_all([('a', '1 / 0'), ('b', 'print(x)')])
+        self.assertIn('ZeroDivisionError', results[0][2])
+        self.assertEqual(results[1], ('b', None, "Execution aborted after an earlier error"))
+        self.assertEqual(self.execute('print(x)'), ('1\n', None))
@@ -1,43 +1,156 @@
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status
+from django.conf import settings
+import functools
 import logging
-import jupyter_client
 import os
 import tempfile
 import subprocess
 import queue
+import re
+import shutil
+import time
 
+from .compilers import ArtifactCache
+from .fastpath import run_trivial_python
+from .kernels import drain_pending, interrupt_execution, iopub_messages, sessions, time_left, wait_for_abort_to_end
 
 logger = logging.getLogger(__name__)
 
-class ExecuteCodeView(APIView):
-    kernels = {}
-    code_sessions = {}
+# Scratch files go to tmpfs when there is one so they never touch the disk,
+# compiled programs only if it is not mounted noexec.
+SCRATCH_DIR = '/dev/shm' if os.path.isdir('/dev/shm') else None
+EXEC_SCRATCH_DIR = SCRATCH_DIR if SCRATCH_DIR and not os.statvfs(SCRATCH_DIR).f_flag & os.ST_NOEXEC else None
+
+compile_cache = ArtifactCache(
+    os.path.join(EXEC_SCRATCH_DIR or tempfile.gettempdir(), 'ide_compile_cache'),
+    getattr(settings, 'IDE_COMPILE_CACHE_SIZE', 256),
+)
+
+# Previews are opened by path after the response is sent, so each one keeps
+# its own file; identical sources share one.
+preview_cache = ArtifactCache(
+    os.path.join(SCRATCH_DIR or tempfile.gettempdir(), 'ide_previews'),
+    getattr(settings, 'IDE_PREVIEW_CACHE_SIZE', 256),
+    suffix='.html',
+)
+
+# Wall-clock budget for one kernel execution, after which the kernel is
+# interrupted so neither the worker nor the session stays blocked on it.
+EXECUTION_TIMEOUT = getattr(settings, 'IDE_EXECUTION_TIMEOUT', 10)
+
+# How long an interrupted execution gets to stop before its kernel is
+# restarted instead.
+INTERRUPT_TIMEOUT = getattr(settings, 'IDE_INTERRUPT_TIMEOUT', 5)
+
+TIMEOUT_ERROR = "Execution timed out. The code may be too complex or there could be a kernel issue."
+
+KERNEL_NAMES = {
+    'python': 'python3',
+    'javascript': 'javascript',
+    'r': 'ir',
+    'java': 'java',
+    'cpp': 'xeus-cling',
+    'c': 'clang',
+}
+
+FILE_EXTENSIONS = {
+    'python': '.py',
+    'javascript': '.js',
+    'cpp': '.cpp',
+    'java': '.java',
+    'r': '.R',
+    'c': '.c',
+}
+
+# Characters of output kept per execution, so a runaway print loop cannot
+# fill the worker's memory or the response.
+OUTPUT_LIMIT = getattr(settings, 'IDE_OUTPUT_LIMIT', 1 << 20)
+
+# javac requires the public class to live in a file of the same name.
+JAVA_MODIFIERS = r'(?:(?:final|abstract|strictfp|sealed|non-sealed|static)\s+)*'
+JAVA_PUBLIC_CLASS_RE = re.compile(
+    rf'^\s*{JAVA_MODIFIERS}public\s+{JAVA_MODIFIERS}class\s+([A-Za-z_$][\w$]*)', re.MULTILINE)
+JAVA_CLASS_RE = re.compile(rf'^\s*{JAVA_MODIFIERS}class\s+([A-Za-z_$][\w$]*)', re.MULTILINE)
+JAVA_COMMENT_OR_STRING_RE = re.compile(r'/\*.*?\*/|//[^\n]*|"""(?:\\.|[^\\])*?"""|"(?:\\.|[^"\\\n])*"|\'(?:\\.|[^\'\\\n])*\'', re.DOTALL)
+
+# javac is a short-lived JVM, so skip C2 compilation and use the serial GC.
+JAVAC_JVM_OPTIONS = ['-J-XX:TieredStopAtLevel=1', '-J-XX:+UseSerialGC']
+
+
+@functools.lru_cache(maxsize=16)
+def resolve_executable(name):
+    # Resolve once so each spawn execs the absolute path instead of trying
+    # every PATH entry in turn.
+    return shutil.which(name) or name
+
+
+def java_class_name(code):
+    """Returns the name of the top-level class javac expects the source file
+    to be named after: the public one, else the first one, else Main."""
+    # Blank out comments and string literals so neither declarations nor
+    # braces inside them are seen.
+    code = JAVA_COMMENT_OR_STRING_RE.sub(lambda match: '""' if match.group(0)[0] in '"\'' else ' ', code)
+    for pattern in (JAVA_PUBLIC_CLASS_RE, JAVA_CLASS_RE):
+        for match in pattern.finditer(code):
+            if code.count('{', 0, match.start()) == code.count('}', 0, match.start()):
+                return match.group(1)
+    return 'Main'
+
+
+class OutputBuffer:
+    """Collects output chunks, dropping whatever comes past the limit."""
+
+    def __init__(self, limit=OUTPUT_LIMIT):
+        self.limit = limit
+        self.size = 0
+        self.truncated = False
+        self.chunks = []
+
+    def append(self, chunk):
+        if self.truncated:
+            return
+        room = self.limit - self.size
+        if len(chunk) > room:
+            self.truncated = True
+            if not room:
+                return
+            chunk = chunk[:room]
+        self.chunks.append(chunk)
+        self.size += len(chunk)
+
+    def getvalue(self):
+        output = '\n'.join(self.chunks)
+        if self.truncated:
+            output += '\n...[output truncated]'
+        return output
+
+
+def session_owner(request):
+    # Anonymous users all share one session per language.
+    return request.user.pk if request.user.is_authenticated else None
 
-    def post(self, request):
-        logger.debug("Received request: %s", request.data)
 
+class ExecuteCodeView(APIView):
+    def post(self, request):
         code = request.data.get("code")
         language = request.data.get("language")
         block_id = request.data.get("block_id")
-        execute_in_order = request.data.get("execute_in_order", False)
 
         if not code or not language:
             logger.error("Code or language not provided")
             return Response({"error": "Code or language not provided"}, status=status.HTTP_400_BAD_REQUEST)
 
-        execution_results = {}
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Received request: language=%s block_id=%s code=%d chars", language, block_id, len(str(code)))
 
-        if execute_in_order:
-            if language not in self.code_sessions:
-                self.code_sessions[language] = []
+        execution_results = {}
+        owner = session_owner(request)
 
-            self.code_sessions[language].append(code)
-            full_code = "\n".join(self.code_sessions[language])
-            result, error = self.execute_code(language, full_code, block_id)
-        else:
-            result, error = self.execute_code(language, code, block_id)
+        # The session kernel keeps the state of earlier blocks, so only the
+        # new block is sent, whether or not execute_in_order is set.
+        result, error = self.execute_code(language, code, block_id, owner)
 
         if error:
             logger.error("Error executing code: %s", error)
@@ -47,28 +160,28 @@ class ExecuteCodeView(APIView):
         execution_results[block_id] = result
         return Response({"output": result})
 
-    def execute_code(self, language, code, block_id):
+    def execute_code(self, language, code, block_id, owner=None):
         if language in ['cpp', 'java', 'c']:
             return self.execute_compiled_code(language, code, block_id)
         elif language in ['html', 'css']:
             return self.execute_html_css(code)
         else:
-            return self.execute_code_with_jupyter(language, code, block_id)
+            return self.execute_code_with_jupyter(language, code, block_id, owner)
 
     def execute_html_css(self, code):
         try:
             
-            with tempfile.NamedTemporaryFile(delete=False, suffix='.html') as tmp_file:
-                tmp_file.write(code.encode())
-                tmp_file_path = tmp_file.name
+            tmp_file_path = preview_cache.path_for('html', code)
+            if not preview_cache.lookup(tmp_file_path):
+                with tempfile.NamedTemporaryFile(delete=False, suffix='.tmp', dir=preview_cache.directory) as tmp_file:
+                    tmp_file.write(code.encode())
+                preview_cache.add(tmp_file.name, tmp_file_path)
 
             
             if os.name == 'nt':  
-                command = f'start {tmp_file_path}'  
+                os.startfile(tmp_file_path)
             else:
-                command = f'xdg-open {tmp_file_path}'  
-
-            subprocess.run(command, shell=True)
+                subprocess.Popen([resolve_executable('xdg-open'), tmp_file_path])
 
             
             return f"HTML/CSS executed successfully. View it at: file://{tmp_file_path}", None
@@ -77,7 +190,7 @@ class ExecuteCodeView(APIView):
             logger.exception("Exception occurred during HTML/CSS execution: %s", e)
             return None, str(e)
 
-    def execute_code_with_jupyter(self, language, code, block_id):
+    def execute_code_with_jupyter(self, language, code, block_id, owner=None):
         km = None
         kc = None
         try:
@@ -86,52 +199,73 @@ class ExecuteCodeView(APIView):
                 logger.error("Unsupported language: %s", language)
                 return None, f"Unsupported language: {language}"
 
-            if language not in self.kernels:
-                km = jupyter_client.KernelManager(kernel_name=kernel_name)
-                km.start_kernel()
-                kc = km.client()
-                kc.start_channels()
-                self.kernels[language] = (km, kc)
-            else:
-                km, kc = self.kernels[language]
-
-            kc.execute(code)
-
-            try:
-                reply = kc.get_shell_msg(timeout=10)
-                logger.debug("Kernel replied with: %s", reply)
-
-                if 'content' in reply and 'status' in reply['content']:
-                    if reply['content']['status'] == 'ok':
-                        result_msgs = []
-                        while True:
-                            msg = kc.get_iopub_msg(timeout=10)
-                            logger.debug("IOPub message received: %s", msg)
-
-                            if msg['msg_type'] == 'execute_result':
-                                result_msgs.append(msg['content'].get('data', {}).get('text/plain', ''))
-                            elif msg['msg_type'] == 'stream':
-                                result_msgs.append(msg['content'].get('text', ''))
-                            elif msg['msg_type'] == 'error':
-                                return None, '\n'.join(msg['content'].get('traceback', ''))
-
-                            if msg['msg_type'] == 'status' and msg['content']['execution_state'] == 'idle':
-                                break
-
-                        result = '\n'.join(result_msgs) or "executed succesfully."
-                        logger.debug("Execution result: %s", result)
-                        return result, None
+            key = (owner, language)
+            if language == 'python':
+                result = run_trivial_python(code)
+                if result is not None:
+                    logger.debug("Evaluated trivial Python without the kernel")
+                    return result or "executed succesfully.", None
+
+            # One execution per kernel at a time, so replies are not interleaved.
+            with sessions.executing(key, kernel_name) as (km, kc):
+                drain_pending(kc)
+                # Nothing is queued behind this execution, and stopping on an
+                # error would have the kernel abort the session's next one.
+                msg_id = kc.execute(code, stop_on_error=False)
+                deadline = time.monotonic() + EXECUTION_TIMEOUT
+                debug_enabled = logger.isEnabledFor(logging.DEBUG)
+                replied = False
+
+                try:
+                    # Late messages of an interrupted execution can still
+                    # arrive after the drain, so only accept our own.
+                    reply = kc.get_shell_msg(timeout=time_left(deadline))
+                    while reply['parent_header'].get('msg_id') != msg_id:
+                        reply = kc.get_shell_msg(timeout=time_left(deadline))
+                    replied = True
+                    if debug_enabled:
+                        logger.debug("Kernel replied with: %s", reply)
+
+                    if 'content' in reply and 'status' in reply['content']:
+                        if reply['content']['status'] == 'ok':
+                            result_msgs = OutputBuffer()
+                            for msg in iopub_messages(kc, deadline):
+                                if debug_enabled:
+                                    logger.debug("IOPub message received: %s", msg)
+                                if msg['parent_header'].get('msg_id') != msg_id:
+                                    continue
+
+                                if msg['msg_type'] == 'execute_result':
+                                    result_msgs.append(msg['content'].get('data', {}).get('text/plain', ''))
+                                elif msg['msg_type'] == 'stream':
+                                    result_msgs.append(msg['content'].get('text', ''))
+                                elif msg['msg_type'] == 'error':
+                                    return None, '\n'.join(msg['content'].get('traceback', ''))
+
+                                if msg['msg_type'] == 'status' and msg['content']['execution_state'] == 'idle':
+                                    break
+
+                            result = result_msgs.getvalue() or "executed succesfully."
+                            logger.debug("Execution result: %s", result)
+                            return result, None
+                        elif reply['content']['status'] == 'aborted':
+                            logger.error("Kernel aborted the execution")
+                            return None, "Execution was aborted by the kernel"
+                        else:
+                            error = reply['content'].get('evalue', 'Unknown error occurred during execution')
+                            logger.error("Kernel execution error: %s", error)
+                            return None, error
                     else:
-                        error = reply['content'].get('evalue', 'Unknown error occurred during execution')
-                        logger.error("Kernel execution error: %s", error)
-                        return None, error
-                else:
-                    logger.error("Invalid reply from kernel")
-                    return None, "Invalid reply from kernel"
+                        logger.error("Invalid reply from kernel")
+                        return None, "Invalid reply from kernel"
 
-            except queue.Empty as timeout_error:
-                logger.error("Kernel execution timed out: %s", timeout_error)
-                return None, "Execution timed out. The code may be too complex or there could be a kernel issue."
+                except queue.Empty as timeout_error:
+                    logger.error("Kernel execution timed out: %s", timeout_error)
+                    # Still holding the session, so the next execution only
+                    # starts once this one has really stopped.
+                    if not replied:
+                        interrupt_execution(km, kc, [msg_id], INTERRUPT_TIMEOUT)
+                    return None, TIMEOUT_ERROR
 
         except Exception as e:
             logger.exception("Exception occurred during code execution: %s", e)
@@ -141,87 +275,95 @@ class ExecuteCodeView(APIView):
                 logger.debug("Keeping kernel alive for language: %s", language)
 
     def execute_compiled_code(self, language, code, block_id):
-        tmp_file_name = None
+        tmp_file_path = None
         try:
             if language == 'java':
-                class_name = code.split()[2]  
-                tmp_file_name = f"{class_name}.java"
+                class_name = java_class_name(code)
+                file_extension = self.get_file_extension(language)
+
+                # javac wants the file named after the class; a directory per
+                # request keeps concurrent runs apart and cleans up in one go.
+                with tempfile.TemporaryDirectory(dir=SCRATCH_DIR) as class_dir:
+                    source_path = os.path.join(class_dir, f"{class_name}{file_extension}")
+                    with open(source_path, 'w') as source_file:
+                        source_file.write(code)
+
+                    commands = self.get_execution_command(language, source_path)
+                    if not commands:
+                        return None, f"Unsupported language: {language}"
+
+                    for command in commands:
+                        output, error = self.run_command(command)
+                        if error is not None:
+                            return None, error
+                    return output, None
+
+            program_path = compile_cache.path_for(language, code)
+            if not compile_cache.lookup(program_path):
+                # gcc and g++ read the source from stdin, only the binary is written.
+                fd, tmp_file_path = tempfile.mkstemp(suffix='.tmp', dir=compile_cache.directory)
+                os.close(fd)
+
+                commands = self.get_execution_command(language, tmp_file_path)
+                if not commands:
+                    return None, f"Unsupported language: {language}"
+
+                _, error = self.run_command(commands[0], stdin=code)
+                if error is not None:
+                    return None, error
+                compile_cache.add(tmp_file_path, program_path)
             else:
-                tmp_file_name = "temp_file"
-
-            file_extension = self.get_file_extension(language)
-
-            with tempfile.NamedTemporaryFile(delete=False, suffix=file_extension) as tmp_file:
-                tmp_file_path = tmp_file.name
-                tmp_file.write(code.encode())
-                tmp_file.flush()
-
-            if language == 'java':
-                os.rename(tmp_file_path, tmp_file_name)
-
-            command = self.get_execution_command(language, tmp_file_name if language == 'java' else tmp_file_path)
-            if not command:
-                return None, f"Unsupported language: {language}"
-
-            logger.debug("Executing command: %s", command)
-            process = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, shell=True)
-
-            if process.returncode != 0:
-                logger.error("Execution error: %s", process.stderr)
-                return None, process.stderr
+                logger.debug("Reusing compiled program: %s", program_path)
 
-            logger.debug("Execution successful, output: %s", process.stdout)
-            return process.stdout, None
+            return self.run_command([program_path])
 
         except Exception as e:
             logger.exception("Exception occurred during execution: %s", e)
             return None, str(e)
         finally:
-            if tmp_file_name and os.path.exists(tmp_file_name):
-                os.remove(tmp_file_name)
-            elif tmp_file_path and os.path.exists(tmp_file_path):
+            if tmp_file_path and os.path.exists(tmp_file_path):
                 os.remove(tmp_file_path)
 
+    def run_command(self, command, stdin=None):
+        logger.debug("Executing command: %s", command)
+        process = subprocess.run(command, input=stdin, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+
+        if process.returncode != 0:
+            logger.error("Execution error: %s", process.stderr)
+            return None, process.stderr
+
+        logger.debug("Execution successful, output: %s", process.stdout)
+        return process.stdout, None
+
     def get_kernel_name(self, language):
-        kernels = {
-            'python': 'python3',
-            'javascript': 'javascript',
-            'r': 'ir',
-            'java': 'java',             
-            'cpp': 'xeus-cling',        
-            'c': 'clang',     
-            
-        }
-        logger.debug("Kernel name for %s: %s", language, kernels.get(language, None))
-        return kernels.get(language, None)
+        kernel_name = KERNEL_NAMES.get(language)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Kernel name for %s: %s", language, kernel_name)
+        return kernel_name
 
     def get_execution_command(self, language, file_path):
-        commands = {
-            'cpp': f'g++ {file_path} -o {file_path}.out && {file_path}.out',
-            'java': f'javac {file_path} && java {file_path.rstrip(".java")}',
-            'c': f'gcc {file_path} -o {file_path}.out && {file_path}.out',
-        }
-        logger.debug("Execution command for %s: %s", language, commands.get(language, None))
-        return commands.get(language, None)
+        if language == 'cpp':
+            commands = [resolve_executable('g++'), '-pipe', '-x', 'c++', '-o', file_path, '-'], [file_path]
+        elif language == 'c':
+            commands = [resolve_executable('gcc'), '-pipe', '-x', 'c', '-o', file_path, '-'], [file_path]
+        elif language == 'java':
+            class_dir, class_file = os.path.split(file_path)
+            commands = [resolve_executable('javac'), *JAVAC_JVM_OPTIONS, file_path], [resolve_executable('java'), '-cp', class_dir, os.path.splitext(class_file)[0]]
+        else:
+            commands = None
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Execution command for %s: %s", language, commands)
+        return commands
 
     def get_file_extension(self, language):
-        extensions = {
-            'python': '.py',
-            'javascript': '.js',
-            'cpp': '.cpp',
-            'java': '.java',
-            'r': '.R',
-            'c': '.c',
-        }
-        logger.debug("File extension for %s: %s", language, extensions.get(language, ''))
-        return extensions.get(language, '')
+        extension = FILE_EXTENSIONS.get(language, '')
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("File extension for %s: %s", language, extension)
+        return extension
 
 
 class ExecuteAllCodeView(APIView):
     def post(self, request):
-        logger.debug("Received request to execute all code blocks: %s", request.data)
-
-        
         code_blocks = request.data.get("code_blocks", [])
         language = request.data.get("language")
 
@@ -232,8 +374,10 @@ class ExecuteAllCodeView(APIView):
 
         
         overall_results = {}
+        owner = session_owner(request)
 
         
+        blocks = []
         for block in code_blocks:
             block_id = block.get("block_id")
             code = block.get("code")
@@ -243,10 +387,18 @@ class ExecuteAllCodeView(APIView):
                 logger.warning("Code or block ID missing for block: %s", block)
                 continue
 
-            
-            result, error = self.execute_code(language, code, block_id)
+            blocks.append((block_id, code))
 
-            
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Received request to execute all code blocks: language=%s blocks=%d", language, len(blocks))
+
+        
+        if language in ['cpp', 'java', 'c', 'html', 'css']:
+            results = [(block_id, *self.execute_code(language, code, block_id, owner)) for block_id, code in blocks]
+        else:
+            results = self.execute_blocks_with_jupyter(language, blocks, owner)
+
+        for block_id, result, error in results:
             if error:
                 logger.error("Error executing block %s: %s", block_id, error)
                 overall_results[block_id] = {"error": error}
@@ -257,11 +409,84 @@ class ExecuteAllCodeView(APIView):
         logger.debug("Execution results for all code blocks: %s", overall_results)
         return Response(overall_results)
 
-    def execute_code(self, language, code, block_id):
+    def execute_code(self, language, code, block_id, owner=None):
         
         if language in ['cpp', 'java', 'c']:
             return ExecuteCodeView().execute_compiled_code(language, code, block_id)
         elif language in ['html', 'css']:
             return ExecuteCodeView().execute_html_css(code)
         else:
-            return ExecuteCodeView().execute_code_with_jupyter(language, code, block_id)
+            return ExecuteCodeView().execute_code_with_jupyter(language, code, block_id, owner)
+
+
+    def execute_blocks_with_jupyter(self, language, blocks, owner=None):
+        if not blocks:
+            return []
+
+        kernel_name = ExecuteCodeView().get_kernel_name(language)
+        if not kernel_name:
+            logger.error("Unsupported language: %s", language)
+            return [(block_id, None, f"Unsupported language: {language}") for block_id, _ in blocks]
+
+        key = (owner, language)
+        try:
+            with sessions.executing(key, kernel_name) as (km, kc):
+                # Queue every block on the kernel up front and route the replies back
+                # by their parent msg_id, instead of one round-trip per block.
+                drain_pending(kc)
+                msg_ids = [kc.execute(code) for _, code in blocks]
+                deadline = time.monotonic() + EXECUTION_TIMEOUT * len(blocks)
+                outputs = {msg_id: OutputBuffer() for msg_id in msg_ids}
+                errors = {}
+                running = set(msg_ids)
+                unreplied = set(msg_ids)
+
+                try:
+                    for msg in iopub_messages(kc, deadline):
+                        msg_id = msg['parent_header'].get('msg_id')
+                        if msg_id not in running:
+                            continue
+
+                        if msg['msg_type'] == 'execute_result':
+                            outputs[msg_id].append(msg['content'].get('data', {}).get('text/plain', ''))
+                        elif msg['msg_type'] == 'stream':
+                            outputs[msg_id].append(msg['content'].get('text', ''))
+                        elif msg['msg_type'] == 'error':
+                            errors[msg_id] = '\n'.join(msg['content'].get('traceback', ''))
+                        elif msg['msg_type'] == 'status' and msg['content']['execution_state'] == 'idle':
+                            running.discard(msg_id)
+                            if not running:
+                                break
+
+                    while unreplied:
+                        reply = kc.get_shell_msg(timeout=time_left(deadline))
+                        msg_id = reply['parent_header'].get('msg_id')
+                        if msg_id not in unreplied:
+                            continue
+                        unreplied.discard(msg_id)
+                        if msg_id in errors:
+                            continue
+                        if reply['content']['status'] == 'aborted':
+                            errors[msg_id] = "Execution aborted after an earlier error"
+                        elif reply['content']['status'] != 'ok':
+                            errors[msg_id] = reply['content'].get('evalue', 'Unknown error occurred during execution')
+                    if errors:
+                        wait_for_abort_to_end(kc, deadline)
+
+                except queue.Empty as timeout_error:
+                    logger.error("Kernel execution timed out: %s", timeout_error)
+                    for msg_id in running:
+                        errors.setdefault(msg_id, TIMEOUT_ERROR)
+                    if unreplied:
+                        interrupt_execution(km, kc, unreplied, INTERRUPT_TIMEOUT)
+        except Exception as e:
+            logger.exception("Exception occurred during code execution: %s", e)
+            return [(block_id, None, str(e)) for block_id, _ in blocks]
+
+        results = []
+        for (block_id, _), msg_id in zip(blocks, msg_ids):
+            if msg_id in errors:
+                results.append((block_id, None, errors[msg_id]))
+            else:
+                results.append((block_id, outputs[msg_id].getvalue() or "executed succesfully.", None))
+        return results
@@ -14,3 +14,8 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'online_ide.settings')
 
 application = get_asgi_application()
+
+# Only processes that serve requests pre-warm kernels, not management
+# commands such as migrate or test.
+from ide.kernels import kernel_pool  # noqa: E402
+kernel_pool.warm_up()
@@ -130,3 +130,34 @@ STATIC_URL = 'static/'
 # https://docs.djangoproject.com/en/5.0/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+
+# Number of idle, pre-started Jupyter kernels kept per kernel name.
+IDE_KERNEL_POOL_SIZES = {
+    'python3': 2,
+    'javascript': 1,
+    'ir': 1,
+}
+
+# Number of compiled C/C++ programs kept for re-runs of the same source.
+IDE_COMPILE_CACHE_SIZE = 256
+
+# Seconds a kernel execution may run before it is interrupted.
+IDE_EXECUTION_TIMEOUT = 10
+
+# Seconds a timed-out execution gets to stop after an interrupt before its
+# kernel is restarted.
+IDE_INTERRUPT_TIMEOUT = 5
+
+# Characters of output returned per execution before it is truncated.
+IDE_OUTPUT_LIMIT = 1 << 20
+
+# Kernel executions allowed to run at once per language; more requests wait.
+IDE_MAX_EXECUTIONS_PER_LANGUAGE = 4
+
+# Number of HTML/CSS preview files kept on disk.
+IDE_PREVIEW_CACHE_SIZE = 256
+
+# Session kernels (one per user and language) kept alive at most, and the
+# seconds of inactivity after which a session's kernel is shut down.
+IDE_MAX_SESSIONS = 32
+IDE_SESSION_IDLE_TIMEOUT = 30 * 60